@@ -1,25 +1,49 @@
 #!/usr/bin/env python3
 
+import asyncio
 import logging
 import argparse
-import pytz
+import random
 import re
+import requests
 import socket
 import time
 import sys
 
-from collections import OrderedDict 
+from collections import OrderedDict, namedtuple
+from operator import itemgetter
 from datetime import datetime
 from todoist.api import TodoistAPI
+from urllib3.util import Retry
+from zoneinfo import ZoneInfo
 
 LAST_RUN_CONST = '$TodoistUpdaterV2LastRun$'
+DELAY_SUFFIX_RE = re.compile(r'(.*)\{([^}]*)\}')
+NO_SUBITEMS = ((), ())
+NameAnnotations = namedtuple('NameAnnotations', ('delay', 'is_parallel', 'is_serial'))
+NO_ANNOTATIONS = NameAnnotations(None, False, False)
 
 timezone = None
 now = None
+now_ts = None
 args = None
+debug_enabled = False
+parallel_suffix = None
+serial_suffix = None
 nodate_label_id = None
 next_label_ids = set()
 rerun = False
+due_cache = {}
+name_cache = {}
+due_timestamps = {}
+hostname = None
+timezones = {}
+item_fingerprints = {}
+project_signatures = {}
+last_run_items_found = False
+indexed_items = {}
+project_items = {}
+project_children = {}
 
 def main():
     """Main process function."""
@@ -28,36 +52,78 @@ def main():
     set_debug()
     debuglog = DebugLogger()
     api = connect(debuglog)
+    asyncio.run(sync_loop(api, debuglog))
+
+async def sync_loop(api, debuglog):
+    """Sync, process and commit, then sleep until the next periodical sync."""
+
+    # The Todoist SDK is blocking, run its network calls in the default executor.
+    loop = asyncio.get_running_loop()
+    # (date, next due timestamp) after a pass that changed nothing, None otherwise.
+    idle = None
 
     while True:
         global rerun
         rerun = False
         try:
-            api.sync()
+            response = await loop.run_in_executor(None, with_backoff, api.sync)
             set_timezone_and_now(api)
 
-            for project in api.projects.all():
-                process_project(api, debuglog, project)
+            if idle is not None and is_idle_sync(response, idle):
+                debuglog.log('Nothing changed since the last pass, skipping.')
+            else:
+                # The pass is CPU bound, keep it off the event loop too.
+                idle = await loop.run_in_executor(None, process_projects, api, debuglog)
 
             if len(api.queue):
-                debuglog.log('changes queued for sync: %s'% str(api.queue))
+                debuglog.log('changes queued for sync: %s', api.queue)
                 if args.execute or args.execute1:
                     logging.debug('Commiting to Todoist.')
-                    api.commit()
+                    await loop.run_in_executor(None, with_backoff, api.commit)
                     if args.execute1: rerun = False
                     if rerun: continue
             else:
                 debuglog.log('No changes queued, skipping sync.')
 
         except Exception as e:
+            idle = None
             logging.exception('Error trying to sync with Todoist API: %s' % str(e))
         
 
         if args.periodical_sync_sec is None:
             break
 
-        debuglog.log('Sleeping for %d seconds' % args.periodical_sync_sec)
-        time.sleep(args.periodical_sync_sec)
+        debuglog.log('Sleeping for %d seconds', args.periodical_sync_sec)
+        await asyncio.sleep(args.periodical_sync_sec)
+
+def process_projects(api, debuglog):
+    """Process all projects, return the idle state if the pass changed nothing."""
+    global last_run_items_found
+    due_cache.clear()
+    name_cache.clear()
+    projects = []
+    archived_project_ids = set()
+    for project in api.projects.all():
+        if project.data['is_archived']:
+            debuglog.log('Project %s is archived, skipping.', project.data['name'])
+            archived_project_ids.add(project.data['id'])
+        else:
+            projects.append(project)
+    # Forget the signatures of deleted and archived projects.
+    project_ids = set(project.data['id'] for project in projects)
+    for project_id in [i for i in project_signatures if i not in project_ids]:
+        del project_signatures[project_id]
+    update_item_index(api, archived_project_ids)
+    build_due_index()
+    last_run_items_found = False
+    for project in projects:
+        project_id = project.data['id']
+        process_project(debuglog, project,
+                        project_items.get(project_id, {}).values(),
+                        project_children.get(project_id, {}))
+    if len(api.queue) or last_run_items_found or rerun:
+        return None
+    return (now.date(), next_due_timestamp())
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -70,8 +136,10 @@ def parse_args():
     parser.add_argument('-x', '--execute', action='store_true', default=False, help='Execute the changes (otherwise just prints them)')
     parser.add_argument('-1', '--execute1', action='store_true', default=False, help='Execute the first round of changes (useful for debugging')
     parser.add_argument('--next_prefix', default='::', help='Prefix for labels that store "Next" tasks (tasks that are available to do)')
-    global args
+    global args, parallel_suffix, serial_suffix
     args = parser.parse_args()
+    parallel_suffix = args.parallel_suffix
+    serial_suffix = args.serial_suffix
 
 def set_debug():
     if args.debug:
@@ -79,6 +147,8 @@ def set_debug():
     else:
         log_level = logging.INFO
     logging.basicConfig(level=log_level)
+    global debug_enabled
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
 
 def connect(parentdebuglog):
     if not args.api_key:
@@ -88,15 +158,16 @@ def connect(parentdebuglog):
     # Run the initial sync
     debuglog = parentdebuglog.sublogger('Connecting to the Todoist API')
     api = TodoistAPI(token=args.api_key)
+    configure_session(api.session)
     debuglog.log('Syncing the current state from the API')
-    api.sync()
+    with_backoff(api.sync)
 
     # Check the NoDate label exists
     labels = api.labels.all(lambda x: x['name'] == args.label)
     if len(labels) > 0:
         global nodate_label_id
         nodate_label_id = labels[0]['id']
-        debuglog.log('Label %s found as label id %d' % (args.label, nodate_label_id))
+        debuglog.log('Label %s found as label id %d', args.label, nodate_label_id)
     else:
         debuglog.error("Label %s doesn't exist, please create it." % args.label)
         sys.exit(1)
@@ -105,28 +176,82 @@ def connect(parentdebuglog):
         lambda x: x['id'],
         api.labels.all(lambda x: x['name'].startswith(args.next_prefix))
     ))
-    debuglog.log('"Next" label ids: %s' % (next_label_ids))
-    
+    debuglog.log('"Next" label ids: %s', next_label_ids)
+
+    global hostname
+    hostname = socket.gethostname()
+
     return api
 
+def configure_session(session):
+    # Keep the connection to the API alive between periodic syncs and retry broken
+    # connections. Sync commands carry a uuid, so resending a POST is safe. Error statuses
+    # and Retry-After are left to with_backoff().
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=1,
+        max_retries=Retry(total=5, backoff_factor=0.5, allowed_methods=None,
+                          respect_retry_after_header=False))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # The SDK returns error responses as data, raise them so they can be retried.
+    session.hooks['response'].append(raise_for_status)
+
+def raise_for_status(response, *args, **kwargs):
+    response.raise_for_status()
+
+def with_backoff(fn, max_attempts=8):
+    """Call fn, retrying with exponential backoff on rate limiting and server errors."""
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except requests.HTTPError as e:
+            status = e.response.status_code
+            if (status != 429 and status < 500) or attempt == max_attempts - 1:
+                raise
+            retry_after = e.response.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                delay = int(retry_after)
+            else:
+                delay = min(60, (2 ** attempt) * 0.5)
+            delay += random.random() * 0.25
+            logging.warning('Todoist API returned %d, retrying in %.1f seconds', status, delay)
+            time.sleep(delay)
+
 class DebugLogger:
     def __init__(self, level = 0):
         self.level = level
-
-    def log(self, str):
-        logging.debug('  ' * self.level + str)
-
-    def sublogger(self, str):
-        self.log(str)
+        self.prefix = '  ' * level
+
+    def log(self, str, *args):
+        if not debug_enabled:
+            return
+        logging.debug(self.prefix + str, *args)
+
+    def sublogger(self, str, *args):
+        if not debug_enabled:
+            # Without debug logging the indentation is never used, so share the logger.
+            return self
+        self.log(str, *args)
         return DebugLogger(self.level + 1)
 
 def set_timezone_and_now(api):
-    global timezone, now
-    timezone = pytz.timezone(api.user.state['user']['tz_info']['timezone'])
+    global timezone, now, now_ts
+    timezone = get_timezone(api.user.state['user']['tz_info']['timezone'])
     now = datetime.now(tz = timezone)
+    now_ts = now.timestamp()
     logging.debug('Timezone: %s, now: %s', timezone, now)
 
+def get_timezone(name):
+    if name not in timezones:
+        timezones[name] = ZoneInfo(name)
+    return timezones[name]
+
 class Props:
+    __slots__ = ('name', 'is_parallel', 'is_serial', 'delay', 'id', 'first',
+                 'has_active_subitems', 'has_completed_subitems', 'owned', 'is_recurring',
+                 'is_due', 'recurring_reactivation', 'due_now', 'suppress_tree_due_now',
+                 'item_due_now')
+
     def __init__(self, name):
         # to avoid pylint warnings:
         self.name = name
@@ -134,17 +259,73 @@ class Props:
         self.is_serial = None
 
     def __repr__(self):
-        p = vars(self)
-        pp = {}
-        for k in p.keys():
-            if p[k] is not None: pp[k] = p[k]
-        return str(pp)
-
-def process_project(api, parentdebuglog, project):
-    if project.data['is_archived']:
-        parentdebuglog.log('Project %s is archived, skipping.' % project.data['name'])
-        return
-
+        fields = []
+        for k in self.__slots__:
+            v = getattr(self, k, None)
+            if v is not None: fields.append('%r: %r' % (k, v))
+        return '{%s}' % ', '.join(fields)
+
+def update_item_index(api, archived_project_ids):
+    """Bring the per-project item and children indexes up to date with the synced state.
+
+    The indexes are kept between syncs, only the items whose position or completion
+    changed are moved, and only the child lists they touched are sorted again. Items of
+    archived projects are left out."""
+    seen_ids = set()
+    moved = []
+    for item in api.items.all():
+        data = item.data
+        if data['project_id'] in archived_project_ids:
+            continue
+        item_id = data['id']
+        seen_ids.add(item_id)
+        key = (data['project_id'], data['parent_id'], data['child_order'], data['checked'])
+        indexed = indexed_items.get(item_id)
+        if indexed is not None and indexed[0] == key and indexed[1] is item:
+            continue
+        if indexed is not None:
+            unindex_item(item_id)
+        moved.append((key[2], key, item))
+
+    for item_id in [i for i in indexed_items if i not in seen_ids]:
+        unindex_item(item_id)
+
+    # Insert the moved items in child_order, so a child list only has to be sorted again
+    # if it already had items in it.
+    moved.sort(key=itemgetter(0))
+    new_buckets = set()
+    dirty_buckets = {}
+    for (unused_child_order, key, item) in moved:
+        item_id = item.data['id']
+        project_items.setdefault(key[0], {})[item_id] = item
+        children = project_children.setdefault(key[0], {})
+        bucket = children.get(key[1])
+        if bucket is None:
+            bucket = children[key[1]] = ([], [])
+            new_buckets.add(key[:2])
+        elif key[:2] not in new_buckets:
+            dirty_buckets[key[:2]] = bucket
+        bucket[1 if key[3] == 0 else 0].append(item)
+        indexed_items[item_id] = (key, item)
+
+    for bucket in dirty_buckets.values():
+        bucket[0].sort(key=child_order_key)
+        bucket[1].sort(key=child_order_key)
+
+def child_order_key(item):
+    return item.data['child_order']
+
+def unindex_item(item_id):
+    ((project_id, parent_id, unused_child_order, checked), item) = indexed_items.pop(item_id)
+    item_fingerprints.pop(item_id, None)
+    del project_items[project_id][item_id]
+    children = project_children[project_id]
+    bucket = children[parent_id]
+    bucket[1 if checked == 0 else 0].remove(item)
+    if not bucket[0] and not bucket[1]:
+        del children[parent_id]
+
+def process_project(parentdebuglog, project, items, children):
     props = Props(project['name'].strip())
     set_parallel_or_serial(props)
     props.owned = None
@@ -152,28 +333,98 @@ def process_project(api, parentdebuglog, project):
     props.recurring_reactivation = None
     props.suppress_tree_due_now = None
 
-    debuglog = parentdebuglog.sublogger('Project: %s' % props)
+    debuglog = parentdebuglog.sublogger('Project: %s', props)
+
+    # If nothing changed since the last pass and no item became due since then, the
+    # pass would be a no-op, so skip it.
+    project_id = project.data['id']
+    (signature, unused_next_due_ts) = project_signature(props, items)
+    last = project_signatures.get(project_id)
+    if last is not None and last[0] == signature and now_ts < last[1]:
+        debuglog.log('Project is unchanged, skipping.')
+        return
 
-    # Get all items for the project, sort by the item_order field.
-    items = sorted(api.items.all(lambda x: x.data['project_id'] == project.data['id']),
-                   key=lambda x: x.data['child_order'])
-    
-    (unused_completed_items, active_items) = get_top_level_items(items)
+    (unused_completed_items, active_items) = get_top_level_items(children)
+
+    # Walk the item tree depth first with an explicit stack instead of recursion.
+    marked = find_marked_subtrees(items)
+    stack = []
+    push_subitems(stack, marked, active_items, props, debuglog)
+    while stack:
+        (item, parentprops, parentdebuglog, idx) = stack.pop()
+        process_item(children, marked, stack, parentprops, parentdebuglog, item, idx)
+
+    # The signature is taken after the pass, because item.update() also updates the
+    # local state. Projects with a last run item have to be processed every time.
+    if any(item.data['content'].startswith(LAST_RUN_CONST) for item in items):
+        global last_run_items_found
+        last_run_items_found = True
+        project_signatures.pop(project_id, None)
+    elif rerun:
+        project_signatures.pop(project_id, None)
+    else:
+        project_signatures[project_id] = project_signature(props, items)
 
-    for idx, item in enumerate(active_items):
-        process_item(items, props, debuglog, item, idx)
+def project_signature(props, items):
+    """Hash the fields of a project's items that processing depends on.
 
-def process_item(items, parentprops, parentdebuglog, item, idx):
-    props = Props(item['content'])
+    Also returns the earliest due timestamp that is still in the future."""
+    fields = [props.name]
+    next_due_ts = float('inf')
+    for item in items:
+        data = item.data
+        due = data['due']
+        fields.append((data['id'], data['parent_id'], data['child_order'], data['checked'],
+                       data['content'], tuple(data['labels']),
+                       due and (due.get('date'), due.get('string'))))
+        due_ts = due_timestamps.get(data['id'])
+        if due_ts is not None and now_ts < due_ts < next_due_ts:
+            next_due_ts = due_ts
+    return (hash(tuple(fields)), next_due_ts)
+
+def find_marked_subtrees(items):
+    """Return the ids of the items with a parallel, serial or last run item in their subtree."""
+    marked = set()
+    for item in items:
+        data = item.data
+        name = data['content']
+        if not name.startswith(LAST_RUN_CONST):
+            annotations = parse_name(name)
+            if not annotations.is_parallel and not annotations.is_serial:
+                continue
+        item_id = data['id']
+        while item_id is not None and item_id not in marked:
+            marked.add(item_id)
+            # The parent might be missing from the local state, stop walking up there.
+            entry = indexed_items.get(item_id)
+            if entry is None:
+                break
+            item_id = entry[0][1]
+    return marked
+
+def push_subitems(stack, marked, subitems, props, debuglog):
+    """Push subitems on the traversal stack so the first one is popped first.
+
+    Outside of parallel and serial trees an item is left alone unless it is a parallel,
+    serial or last run item itself, so only the subtrees containing one are pushed."""
+    owned = props.owned or props.is_parallel or props.is_serial
+    for idx in range(len(subitems) - 1, -1, -1):
+        item = subitems[idx]
+        if owned or item.data['id'] in marked:
+            stack.append((item, props, debuglog, idx))
+
+def process_item(children, marked, stack, parentprops, parentdebuglog, item, idx):
+    data = item.data
+    props = Props(data['content'])
     set_parallel_or_serial(props)
 
-    props.id = item.data['id']
+    props.id = data['id']
     props.first = idx == 0
 
-    (completed_subitems, active_subitems) = get_subitems(items, item)
+    (completed_subitems, active_subitems) = get_subitems(children, item)
 
-    props.has_active_subitems = len(active_subitems) > 0
-    props.has_completed_subitems = len(completed_subitems) > 0 or None
+    props.has_active_subitems = bool(active_subitems)
+    props.has_completed_subitems = bool(completed_subitems) or None
 
     props.owned = parentprops.owned or props.is_parallel or props.is_serial
     props.is_recurring = is_recurring(item)
@@ -195,83 +446,102 @@ def process_item(items, parentprops, parentdebuglog, item, idx):
     props.item_due_now = props.due_now and not props.suppress_tree_due_now and not (
         (props.is_parallel or props.is_serial) and props.has_active_subitems)
 
-    debuglog = parentdebuglog.sublogger('Item: %s' % props)
+    debuglog = parentdebuglog.sublogger('Item: %s', props)
 
     if props.recurring_reactivation:
         complete_item(item, debuglog)
-        for item in completed_subitems:
-            reactivate_completed_subtree(items, props, debuglog, item)
+        reactivate_completed_subtrees(children, debuglog, completed_subitems)
         # We need to rerun the sync after the subtree is completed, because these items
         # will be active in the next run.
         global rerun
         rerun = True
         return
 
-    if props.item_due_now:
-        activate_item(item, props, debuglog)
-    elif props.owned:
-        own_item(item, debuglog)
-
-    if item['content'].startswith(LAST_RUN_CONST):
+    # The changes are collected and sent as a single item_update command.
+    changes = {}
+    # Activating or owning an item only depends on these, so if none of them changed
+    # since a pass that left the item untouched, it would be left untouched again.
+    fingerprint = (props.name, tuple(data['labels']), data['due'] is None,
+                   props.item_due_now, props.owned)
+    if item_fingerprints.get(props.id) != fingerprint:
+        if props.item_due_now:
+            changes = activate_item(item, props, debuglog)
+        elif props.owned:
+            changes = own_item(item, debuglog)
+
+    if props.name.startswith(LAST_RUN_CONST):
         debuglog.log('## Updating last run timestamp')
-        item.update(content = LAST_RUN_CONST + ': %s %s' % (socket.gethostname(), now))
+        changes['content'] = LAST_RUN_CONST + ': %s %s' % (hostname, now)
+
+    if changes:
+        item.update(**changes)
+        item_fingerprints.pop(props.id, None)
+    else:
+        item_fingerprints[props.id] = fingerprint
 
-    for idx, item in enumerate(active_subitems):
-        process_item(items, props, debuglog, item, idx)
+    push_subitems(stack, marked, active_subitems, props, debuglog)
 
-def reactivate_completed_subtree(items, parentprops, parentdebuglog, item):
-    props = Props(item['content'])
+def reactivate_completed_subtrees(children, rootdebuglog, items):
+    stack = [(item, rootdebuglog) for item in reversed(items)]
+    while stack:
+        (item, parentdebuglog) = stack.pop()
+        props = Props(item['content'])
 
-    debuglog = parentdebuglog.sublogger('Reactivating item: %s' % props)
+        debuglog = parentdebuglog.sublogger('Reactivating item: %s', props)
 
-    uncomplete_item(item, debuglog)
+        uncomplete_item(item, debuglog)
 
-    (completed_subitems, unused_active_subitems) = get_subitems(items, item)
-    for item in completed_subitems:
-        reactivate_completed_subtree(items, props, debuglog, item)
+        (completed_subitems, unused_active_subitems) = get_subitems(children, item)
+        stack.extend((subitem, debuglog) for subitem in reversed(completed_subitems))
 
     # Note: for now, we just reactivate the completed items, but it might be possible that
     # there are some completed items under currently active tasks. Consider recursing into
     # active_subitems, too
 
 def set_parallel_or_serial(props):
-    name = props.name
-    (props.delay, name) = has_delay_suffix(name)
-    props.is_parallel = name.endswith(args.parallel_suffix)
-    props.is_serial = name.endswith(args.serial_suffix)
-
-def get_top_level_items(items):
-    return get_subitems(items, None)
-
-def get_subitems(items, parent_item):
-    """Search a flat item list for child items."""
+    (props.delay, props.is_parallel, props.is_serial) = parse_name(props.name)
+
+def parse_name(name):
+    """Return the (delay, is_parallel, is_serial) annotations of a project or item name."""
+    if name in name_cache: return name_cache[name]
+    name_cache[name] = parse_name_annotations(name)
+    return name_cache[name]
+
+def parse_name_annotations(name):
+    if '{' not in name:
+        # Most names have no annotations at all, share a single instance for them.
+        if not name.endswith((parallel_suffix, serial_suffix)):
+            return NO_ANNOTATIONS
+        return NameAnnotations(None, name.endswith(parallel_suffix), name.endswith(serial_suffix))
+    (delay, name) = has_delay_suffix(name)
+    return NameAnnotations(delay, name.endswith(parallel_suffix), name.endswith(serial_suffix))
+
+def get_top_level_items(children):
+    return get_subitems(children, None)
+
+def get_subitems(children, parent_item):
+    """Look up the (completed, active) child items of an item in the children index."""
     parent_id = None
     if parent_item:
-        parent_id = parent_item['id']
-    completed_result_items = []
-    active_result_items = []
-    for item in items:
-        if item['parent_id'] == parent_id:
-            if item.data['checked'] == 0:
-                active_result_items.append(item)
-            else:
-                completed_result_items.append(item)
-    return (completed_result_items, active_result_items)
+        parent_id = parent_item.data['id']
+    return children.get(parent_id, NO_SUBITEMS)
 
 def has_delay_suffix(str):
-    m = re.match('(.*){(.*?)}', str)
+    m = DELAY_SUFFIX_RE.match(str)
     if m:
         return (m.group(2), m.group(1))
     else:
         return (None, str)
 
 def own_item(item, debuglog):
-    if item['due'] is None:
-        add_nodate_label(item, debuglog)
+    if item.data['due'] is None:
+        return add_nodate_label(item, debuglog)
+    return {}
 
 def activate_item(item, props, debuglog):
-    set_date(item, props, debuglog)
-    remove_nodate_label(item, debuglog)
+    changes = set_date(item, props, debuglog)
+    changes.update(remove_nodate_label(item, debuglog))
+    return changes
 
 def uncomplete_item(item, debuglog):
     if item['date_completed'] is not None:
@@ -287,51 +557,81 @@ def complete_item(item, debuglog):
         item.close()
 
 def add_nodate_label(item, debuglog):
-    if nodate_label_id in item['labels']:
-        return
-    labels = item['labels']
-    debuglog.log('## Updating %s with "NoDate" label' % item['content'])
-    labels.append(nodate_label_id)
-    item.update(labels=labels)
+    labels = item.data['labels']
+    if nodate_label_id in labels:
+        return {}
+    debuglog.log('## Updating %s with "NoDate" label', item['content'])
+    return {'labels': labels + [nodate_label_id]}
 
 def remove_nodate_label(item, debuglog):
-    if not nodate_label_id in item['labels']:
-        return
-    labels = item['labels']
-    debuglog.log('## Removing "NoDate" label from %s' % (item['content']))
-    labels.remove(nodate_label_id)
-    item.update(labels=labels)
+    labels = item.data['labels']
+    if not nodate_label_id in labels:
+        return {}
+    debuglog.log('## Removing "NoDate" label from %s', item['content'])
+    return {'labels': [l for l in labels if l != nodate_label_id]}
 
 def set_date(item, props, debuglog):
-    if set(item['labels']).intersection(next_label_ids):
-        debuglog.log('## Not setting due date for item %s, because one of the "Next" labels exist' % (item['content']))
-        return
-    if item['due'] is None:
+    data = item.data
+    if next_label_ids and any(l in next_label_ids for l in data['labels']):
+        debuglog.log('## Not setting due date for item %s, because one of the "Next" labels exist', item['content'])
+        return {}
+    if data['due'] is None:
         new_due = props.delay if props.delay is not None else 'today'
-        debuglog.log('## Setting due date to %s for item %s' % (new_due, item['content']))
-        item.update(due={'string' : new_due })
+        debuglog.log('## Setting due date to %s for item %s', new_due, item['content'])
+        return {'due': {'string' : new_due }}
+    return {}
 
 def is_recurring(item):
-    due = item['due']
+    due = item.data['due']
     return due['is_recurring'] if not due is None else False
 
+def is_idle_sync(response, idle):
+    """Check whether a pass after this sync would be the same no-op as the last one."""
+    if response.get('full_sync'):
+        return False
+    if any(response.get(key) for key in ('items', 'projects', 'labels', 'user')):
+        return False
+    (date, next_due_ts) = idle
+    return now.date() == date and now_ts < next_due_ts
+
+def next_due_timestamp():
+    """Return the earliest due timestamp that is still in the future."""
+    return min((due_ts for due_ts in due_timestamps.values() if due_ts > now_ts),
+               default=float('inf'))
+
+def build_due_index():
+    """Parse the due dates of all indexed active items into POSIX timestamps keyed by item id."""
+    due_timestamps.clear()
+    for (unused_key, item) in indexed_items.values():
+        data = item.data
+        if data['checked'] != 0: continue
+        due = parse_due(item)
+        if due is not None:
+            due_timestamps[data['id']] = due.timestamp()
+
 def is_due(item):
-    due = parse_due(item)
-    if due is None: return False
-    # logging.debug("is_active: due parsed: %s", due)
-    return due <= now
+    due_ts = due_timestamps.get(item.data['id'])
+    if due_ts is None: return False
+    return due_ts <= now_ts
 
 def parse_due(item):
-    due = item['due']
+    due = item.data['due']
     if due is None: return None
-    tz = due['timezone'] if due['timezone'] is not None else timezone
-
-    try:
-        due_date = datetime.strptime(due['date'], '%Y-%m-%dT%H:%M:%S')
-    except:
-        due_date = datetime.strptime(due['date'], '%Y-%m-%d')
-
-    return tz.localize(due_date)
+    # The result only depends on the date, its timezone and the user's timezone, which
+    # is fixed until the cache is cleared on the next sync.
+    key = (due['date'], due['timezone'])
+    if key in due_cache: return due_cache[key]
+    tz = get_timezone(due['timezone']) if due['timezone'] is not None else timezone
+
+    # Floating due dates are 'YYYY-MM-DD' or 'YYYY-MM-DDTHH:MM:SS' in local time, dues with
+    # a fixed timezone are 'YYYY-MM-DDTHH:MM:SSZ' in UTC.
+    date = due['date']
+    if date.endswith('Z'):
+        due_date = datetime.fromisoformat(date[:-1]).replace(tzinfo=get_timezone('UTC'))
+        due_cache[key] = due_date.astimezone(tz)
+    else:
+        due_cache[key] = datetime.fromisoformat(date).replace(tzinfo=tz)
+    return due_cache[key]
 
 if __name__ == '__main__':
     main()